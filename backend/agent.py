@@ -1,40 +1,55 @@
 import os
+import re
 import json
-import yfinance as yf
+import hashlib
+import logging
+import numpy as np
+import pandas as pd
 from dotenv import load_dotenv
-from sqlmodel import Session, select, func, text
-from .database import engine
+from sqlmodel import select, func, text, case, delete
+from .database import SessionLocal
 from .models import Transaction, Holding
 from .ingestion import add_manual_transaction, update_holdings
-from .utils import get_market_data_mock
+from .utils import get_market_data_mock, get_quote_prices
+from .cache import get_cached, set_cached, ai_response_cache, portfolio_analysis_cache, get_portfolio_version
 from datetime import datetime
+from typing import Literal
+from pydantic import BaseModel
 from crewai import Agent, Task, Crew, Process, LLM
 from crewai.tools import tool
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # --- Telemetry & Optimization ---
 # Disable CrewAI telemetry to prevent connection timeouts in restricted environments
 os.environ["OTEL_SDK_DISABLED"] = "true"
+# Step-by-step agent logging is costly console I/O on every LLM/tool step; opt in when debugging
+CREW_VERBOSE = os.environ.get("CREW_VERBOSE", "false").lower() == "true"
 
 # --- LLM Configurations ---
 # 1. Fast Model (Routing, Simple Tasks, Formatting)
 llm_fast = LLM(
     model="gemini/gemini-flash-lite-latest",
     api_key=os.environ.get("GOOGLE_API_KEY"),
-    temperature=0.1
+    temperature=0,
+    max_tokens=4096
 )
 
-# 2. Reasoning Model (Complex Analysis, SQL Generation)
-# Using flash-lite here too to avoid the strict 429 quotas of the 'pro' model in this environment
+# 2. Reasoning Model (Complex Analysis, SQL Generation, Final Answers)
+# Defaults to flash-lite too to avoid the strict 429 quotas of the 'pro' model; set REASONING_MODEL where quota allows
 llm_reasoning = LLM(
-    model="gemini/gemini-flash-lite-latest", 
+    model=os.environ.get("REASONING_MODEL", "gemini/gemini-flash-lite-latest"),
     api_key=os.environ.get("GOOGLE_API_KEY"),
-    temperature=0.1
+    temperature=0,
+    max_tokens=4096
 )
 
 # --- Specialized Tool Functions ---
 
+MAX_SQL_ROWS = 500
+
 @tool("execute_sql_query")
 def execute_sql_query(query: str):
     """
@@ -47,19 +62,26 @@ def execute_sql_query(query: str):
     2. "holding": columns [symbol (PK), stock_name, isin, quantity, avg_price, total_invested, geography, category, last_transaction_date]
     
     IMPORTANT: The "transaction" table name is a reserved keyword in some SQL dialects, always quote it as `"transaction"` in your queries.
-    DATES: execution_time is stored as a string. Use strftime('%Y', execution_time) or strftime('%Y-%m', execution_time) for filtering.
+    DATES: execution_time is stored as an ISO string ('YYYY-MM-DD HH:MM:SS'). Filter with plain range comparisons so the
+    execution_time index is used, e.g. execution_time >= '2025-01-01' AND execution_time < '2026-01-01'; never wrap the
+    column in strftime() inside WHERE. strftime('%Y-%m', execution_time) is fine in SELECT/GROUP BY for bucketing.
+    At most 500 rows are returned ("truncated" is true when there were more); aggregate or add LIMIT for large results.
     """
     if not query.strip().upper().startswith("SELECT"):
         return {"error": "Only SELECT queries are allowed for security reasons."}
     
-    with Session(engine) as session:
+    with SessionLocal() as session:
         try:
             result = session.exec(text(query))
-            rows = [dict(row._mapping) for row in result]
+            # Fetch at most MAX_SQL_ROWS (+1 to detect more); the LLM can't use more rows than that anyway
+            rows = [dict(row._mapping) for row in result.fetchmany(MAX_SQL_ROWS + 1)]
+            truncated = len(rows) > MAX_SQL_ROWS
+            rows = rows[:MAX_SQL_ROWS]
             return {
                 "status": "success",
                 "data": rows,
                 "count": len(rows),
+                "truncated": truncated,
                 "query": query
             }
         except Exception as e:
@@ -68,57 +90,79 @@ def execute_sql_query(query: str):
 @tool("get_market_data")
 def get_market_data(symbol: str):
     """
-    Fetches live market price and details for a stock symbol (e.g., RELIANCE.NS, AAPL).
+    Fetches live market price and details for one or more stock symbols (e.g., RELIANCE.NS, AAPL).
+    Pass several symbols comma-separated (e.g., "TCS.NS, INFY.NS") to fetch them in a single request.
     Falls back to mock data if the network is restricted.
     """
+    symbols = [s.strip() for s in symbol.split(",") if s.strip()]
+    # One batched download for every symbol (recent quotes are served from cache)
     try:
-        ticker = yf.Ticker(symbol)
-        info = ticker.fast_info
-        price = info.last_price
-        
-        if price is None or price == 0:
-            raise ValueError("Price not found")
+        prices = get_quote_prices(symbols)
+    except Exception:
+        prices = {}
 
-        return {
-            "symbol": symbol,
+    results = []
+    for s in symbols:
+        price = prices.get(s)
+        if not price:
+            mock_data = get_market_data_mock(s)
+            mock_data["source"] = "mock_data"
+            results.append(mock_data)
+            continue
+        results.append({
+            "symbol": s,
             "price": price,
-            "currency": "INR" if ".NS" in symbol or ".BO" in symbol else "USD",
+            "currency": "INR" if s.endswith((".NS", ".BO")) else "USD",
             "last_updated": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             "source": "Live Market Data",
             "status": "success"
-        }
-    except Exception as e:
-        mock_data = get_market_data_mock(symbol)
-        mock_data["source"] = "mock_data"
-        return mock_data
+        })
+    return results[0] if len(results) == 1 else results
 
 @tool("get_portfolio_analysis")
 def get_portfolio_analysis():
     """
     Analyzes the user's holdings and transactions to provide a summary.
     """
-    with Session(engine) as session:
-        holdings = session.exec(select(Holding)).all()
-        transactions = session.exec(select(Transaction)).all()
+    # Agents often call this several times per turn; it only changes when the portfolio does
+    cached = get_cached(portfolio_analysis_cache, "summary")
+    if cached is not None:
+        return cached
+    portfolio_version = get_portfolio_version()
+
+    with SessionLocal() as session:
+        # Only the reported columns, as plain rows rather than Holding objects
+        holdings = session.exec(
+            select(Holding.symbol, Holding.stock_name, Holding.quantity, Holding.avg_price, Holding.total_invested)
+        ).all()
+        # Totals come from SQLite in one row; the transaction table is only counted, never loaded
+        total_invested, transaction_count = session.exec(
+            select(
+                func.coalesce(func.sum(Holding.total_invested), 0.0),
+                select(func.count()).select_from(Transaction).scalar_subquery(),
+            )
+        ).one()
         
         holdings_list = [
             {
-                "symbol": h.symbol,
-                "name": h.stock_name,
-                "quantity": h.quantity,
-                "avg_cost": h.avg_price,
-                "total_invested": h.total_invested
-            } for h in holdings
+                "symbol": symbol,
+                "name": name,
+                "quantity": quantity,
+                "avg_cost": avg_price,
+                "total_invested": invested
+            } for symbol, name, quantity, avg_price, invested in holdings
         ]
-        
-        total_invested = sum(h.total_invested for h in holdings)
-        
-        return {
-            "holdings": holdings_list,
-            "total_invested_value": total_invested,
-            "transaction_count": len(transactions),
-            "source": "internal-db"
-        }
+
+    summary = {
+        "holdings": holdings_list,
+        "total_invested_value": total_invested,
+        "transaction_count": transaction_count,
+        "source": "internal-db"
+    }
+    # Skip caching if a write landed while we were reading
+    if get_portfolio_version() == portfolio_version:
+        set_cached(portfolio_analysis_cache, "summary", summary)
+    return summary
 
 @tool("get_historical_holdings")
 def get_historical_holdings(date_str: str):
@@ -132,70 +176,76 @@ def get_historical_holdings(date_str: str):
     except ValueError:
         return {"status": "error", "message": "Invalid date format. Please use YYYY-MM-DD."}
 
-    with Session(engine) as session:
-        # Fetch all transactions up to the target date
-        transactions = session.exec(
-            select(Transaction).where(Transaction.execution_time <= target_date)
+    tx_type = func.upper(Transaction.type)
+    signed_qty = case((tx_type == "BUY", Transaction.quantity), (tx_type == "SELL", -Transaction.quantity), else_=0.0)
+    with SessionLocal() as session:
+        # Transactions up to the target date, oldest first (selling is path dependent),
+        # with the running quantity per symbol computed by SQLite
+        rows = session.exec(
+            select(
+                Transaction.symbol,
+                Transaction.stock_name,
+                tx_type,
+                Transaction.quantity,
+                Transaction.price,
+                signed_qty,
+                func.sum(signed_qty).over(
+                    partition_by=Transaction.symbol,
+                    order_by=(Transaction.execution_time, Transaction.id),
+                ),
+            )
+            .where(Transaction.execution_time <= target_date)
+            .order_by(Transaction.execution_time, Transaction.id)
         ).all()
         
-        if not transactions:
-            return {"status": "success", "date": date_str, "holdings": [], "total_invested": 0, "message": "No transactions found on or before this date."}
-
-        # Aggregate holdings
-        historical_holdings = {}
-        for tx in transactions:
-            symbol = tx.symbol
-            if symbol not in historical_holdings:
-                historical_holdings[symbol] = {
-                    "symbol": symbol,
-                    "name": tx.stock_name,
-                    "quantity": 0,
-                    "total_cost": 0.0
-                }
-            
-            if tx.type.upper() == "BUY":
-                historical_holdings[symbol]["quantity"] += tx.quantity
-                historical_holdings[symbol]["total_cost"] += (tx.quantity * tx.price)
-            elif tx.type.upper() == "SELL":
-                historical_holdings[symbol]["quantity"] -= tx.quantity
-                # For historical cost, we'll keep it simple: reduce proportion. 
-                # (Actual avg cost calculation usually depends on FIFO/LIFO, 
-                # but simple aggregation is sufficient for basic historical comparison).
-                if historical_holdings[symbol]["quantity"] > 0:
-                    historical_holdings[symbol]["total_cost"] *= ( (historical_holdings[symbol]["quantity"]) / (historical_holdings[symbol]["quantity"] + tx.quantity) )
-                else:
-                    historical_holdings[symbol]["total_cost"] = 0
-
-        # Filter out zero holdings and format
-        result_list = []
-        total_value = 0
-        for symbol, data in historical_holdings.items():
-            if data["quantity"] > 0:
-                avg_price = data["total_cost"] / data["quantity"] if data["quantity"] > 0 else 0
-                result_list.append({
-                    "symbol": symbol,
-                    "name": data["name"],
-                    "quantity": data["quantity"],
-                    "avg_cost": round(avg_price, 2),
-                    "total_invested": round(data["total_cost"], 2)
-                })
-                total_value += data["total_cost"]
-
-        return {
-            "status": "success",
-            "date": date_str,
-            "holdings": result_list,
-            "total_invested_value": round(total_value, 2),
-            "transaction_count": len(transactions),
-            "source": "internal-db-history"
-        }
+    if not rows:
+        return {"status": "success", "date": date_str, "holdings": [], "total_invested": 0, "message": "No transactions found on or before this date."}
+
+    df = pd.DataFrame(rows, columns=["symbol", "name", "type", "quantity", "price", "signed_qty", "qty_after"])
+    is_buy = (df["type"] == "BUY").to_numpy()
+    is_sell = (df["type"] == "SELL").to_numpy()
+    quantity = df["quantity"].to_numpy(dtype=float)
+    signed_qty = df["signed_qty"].to_numpy(dtype=float)
+    qty_after = df["qty_after"].to_numpy(dtype=float)
+
+    # A sell keeps cost in proportion to the remaining quantity (average cost is unchanged),
+    # or wipes it when nothing is left. Each buy's cost is therefore scaled by the product of
+    # the retention factors of every later sell of the same symbol.
+    with np.errstate(divide="ignore", invalid="ignore"):
+        retained = np.where(qty_after > 0, qty_after / (qty_after + quantity), 0.0)
+    factor = pd.Series(np.where(is_sell, retained, 1.0))
+    later_factor = factor[::-1].groupby(df["symbol"][::-1]).cumprod()[::-1].to_numpy()
+    cost = np.where(is_buy, quantity * df["price"].to_numpy(dtype=float) * later_factor, 0.0)
+
+    summary = pd.DataFrame({"symbol": df["symbol"], "name": df["name"], "quantity": signed_qty, "total_cost": cost})
+    summary = summary.groupby("symbol", sort=False).agg(name=("name", "first"), quantity=("quantity", "sum"), total_cost=("total_cost", "sum"))
+    summary = summary[summary["quantity"] > 0]
+
+    result_list = [
+        {
+            "symbol": symbol,
+            "name": name,
+            "quantity": qty,
+            "avg_cost": round(total_cost / qty, 2),
+            "total_invested": round(total_cost, 2)
+        } for symbol, name, qty, total_cost in zip(summary.index, summary["name"], summary["quantity"], summary["total_cost"])
+    ]
+
+    return {
+        "status": "success",
+        "date": date_str,
+        "holdings": result_list,
+        "total_invested_value": round(float(summary["total_cost"].sum()), 2),
+        "transaction_count": len(rows),
+        "source": "internal-db-history"
+    }
 
 @tool("place_order_tool")
 def place_order_tool(symbol: str, tx_type: str, quantity: int, price: float, exchange: str = "NSE"):
     """
     Places a manual transaction order in the database and updates holdings.
     """
-    with Session(engine) as session:
+    with SessionLocal() as session:
         try:
             transaction = add_manual_transaction(
                 session=session,
@@ -218,23 +268,23 @@ def delete_transaction_tool(order_id: str = None, symbol: str = None):
     """
     Deletes transactions by order ID or all transactions for a specific symbol.
     """
-    with Session(engine) as session:
+    with SessionLocal() as session:
         try:
+            # Single DELETE statements; the affected row count doubles as the existence check
             if order_id:
-                transaction = session.exec(select(Transaction).where(Transaction.order_id == order_id)).first()
-                if not transaction:
+                # order_id isn't unique (re-uploaded MF statements repeat it); remove a single row, picked by id
+                first_match = select(Transaction.id).where(Transaction.order_id == order_id).order_by(Transaction.id).limit(1)
+                result = session.execute(delete(Transaction).where(Transaction.id == first_match.scalar_subquery()))
+                if result.rowcount == 0:
                     return {"status": "error", "message": "Transaction not found."}
-                session.delete(transaction)
                 msg = f"Transaction {order_id} deleted."
             elif symbol:
-                transactions = session.exec(select(Transaction).where(Transaction.symbol == symbol.upper())).all()
-                if not transactions:
+                result = session.execute(delete(Transaction).where(Transaction.symbol == symbol.upper()))
+                if result.rowcount == 0:
                     return {"status": "error", "message": "No transactions found."}
-                for tx in transactions:
-                    session.delete(tx)
-                msg = f"All transactions for {symbol} deleted."
+                msg = f"All {result.rowcount} transactions for {symbol} deleted."
             
-            session.commit()
+            # Commits the delete together with the resynced holdings
             update_holdings(session)
             return {"status": "success", "message": msg}
         except Exception as e:
@@ -260,10 +310,11 @@ market_analyst = Agent(
     backstory="""You fetch accurate market data. 
     IMPORTANT: If you use the output of a tool that mentions 'mock_data', you MUST explicitly write the phrase 'mock_data' in your final answer. 
     If the tool output indicates 'Live Market Data', you MUST explicitly write the phrase 'Live Market Data' in your final answer. 
-    This is a strict requirement from the user.""",
+    This is a strict requirement from the user.
+    When several prices are needed, fetch them in ONE get_market_data call with comma-separated symbols.""",
     tools=[get_market_data],
     llm=llm_reasoning, 
-    verbose=True,
+    verbose=CREW_VERBOSE,
     allow_delegation=False
 )
 
@@ -276,7 +327,7 @@ portfolio_specialist = Agent(
     Always mention that the data is from the internal database.""",
     tools=[get_portfolio_analysis],
     llm=llm_fast,
-    verbose=True,
+    verbose=CREW_VERBOSE,
     allow_delegation=False
 )
 
@@ -286,7 +337,7 @@ data_ingester = Agent(
     backstory="""You ensure data follows rules and schemas.""",
     tools=[get_portfolio_analysis],
     llm=llm_fast,
-    verbose=True,
+    verbose=CREW_VERBOSE,
     allow_delegation=False
 )
 
@@ -299,10 +350,11 @@ analytics_agent = Agent(
     HISTORICAL ANALYSIS: If the user asks for a comparison across dates (e.g., "Jan 2025 vs Jan 2026"), you MUST use the 'get_historical_holdings' tool for EACH date to reconstruct the portfolio state at those times.
     NEVER invent or hallucinate holdings. Check tables 'transaction' and 'holding' in database.
     SUPER REQUIREMENT: Always attempt to provide a "Macro Insight" or "Risk Score" based on the holdings you find. 
-    If you see high concentration in one stock, warn the user. If the data is empty, suggest how to get started.""",
-    tools=[get_portfolio_analysis, execute_sql_query, get_historical_holdings],
+    If you see high concentration in one stock, warn the user. If the data is empty, suggest how to get started.
+    For current prices of several holdings, make ONE get_market_data call with comma-separated symbols.""",
+    tools=[get_portfolio_analysis, execute_sql_query, get_historical_holdings, get_market_data],
     llm=llm_reasoning,
-    verbose=True,
+    verbose=CREW_VERBOSE,
     allow_delegation=False
 )
 
@@ -312,7 +364,7 @@ trading_agent = Agent(
     backstory="""You handle order placements and deletions precisely.""",
     tools=[place_order_tool, delete_transaction_tool],
     llm=llm_fast,
-    verbose=True,
+    verbose=CREW_VERBOSE,
     allow_delegation=False
 )
 
@@ -322,7 +374,7 @@ visual_agent = Agent(
     backstory="""You transform numbers into chart JSON.""",
     tools=[generate_chart_data],
     llm=llm_fast,
-    verbose=True,
+    verbose=CREW_VERBOSE,
     allow_delegation=False
 )
 
@@ -334,7 +386,7 @@ sql_agent = Agent(
     1. Table "transaction":
        - columns: [id, stock_name, symbol, isin, type (BUY/SELL), quantity, price, exchange, order_id, execution_time, geography, category, status]
        - Note: Always quote as `"transaction"` because it's a reserved keyword.
-       - Note: execution_time is a timestamp. For monthly/yearly comparisons, use SQLite date functions like strftime('%m', execution_time) or strftime('%Y', execution_time).
+       - Note: execution_time is an ISO timestamp string. Filter dates with range comparisons, e.g. execution_time >= '2025-01-01' AND execution_time < '2026-01-01', so the index is used; don't filter on strftime(..., execution_time). For monthly/yearly comparisons, bucket with strftime('%Y-%m', execution_time) in SELECT/GROUP BY.
     2. Table "holding":
        - columns: [symbol, stock_name, isin, quantity, avg_price, total_invested, geography, category, last_transaction_date]
     
@@ -342,45 +394,153 @@ sql_agent = Agent(
     Always prioritize accuracy and double-check column names against the schema provided above.""",
     tools=[execute_sql_query],
     llm=llm_reasoning,
-    verbose=True,
+    verbose=CREW_VERBOSE,
     allow_delegation=False
 )
 
+# --- Fast Path Routing ---
+# Most questions need exactly one read-only tool; answering those directly costs two LLM calls
+# (route + phrase) instead of a manager plus delegated-agent round trips.
+
+class QueryRoute(BaseModel):
+    route: Literal["portfolio", "market", "historical", "complex"]
+    symbols: str = ""
+    date: str = ""
+
+ROUTER_PROMPT = """Classify the user's portfolio question. Routes:
+- portfolio: current holdings/portfolio summary.
+- market: live price of given tickers; put them comma-separated in "symbols" (e.g. "TCS.NS, AAPL").
+- historical: holdings on one past date; put it in "date" as YYYY-MM-DD.
+- complex: anything else (comparisons, SQL-style questions, orders, deletions, charts).
+Reply with JSON only: {"route": ..., "symbols": ..., "date": ...}"""
+
+ANSWER_PROMPT = """Answer the user's question using ONLY the tool output below; never invent holdings.
+If it has no holdings, say the portfolio is empty. Say the data is from the internal database.
+If prices are involved, state whether they are 'Live Market Data' or 'mock_data'.
+End with a follow-up question."""
+
+# Direct-answer routes: route name -> (QueryRoute field the tool needs, tool invocation)
+ROUTE_TOOLS = {
+    "portfolio": (None, lambda route: get_portfolio_analysis.run()),
+    "market": ("symbols", lambda route: get_market_data.run(symbol=route.symbols)),
+    "historical": ("date", lambda route: get_historical_holdings.run(date_str=route.date)),
+}
+
+def _route_query(user_query: str) -> QueryRoute:
+    reply = llm_fast.call(
+        [{"role": "system", "content": ROUTER_PROMPT}, {"role": "user", "content": user_query}],
+        response_model=QueryRoute
+    )
+    if isinstance(reply, QueryRoute):
+        return reply
+    return QueryRoute.model_validate_json(str(reply).strip().removeprefix("```json").strip("`"))
+
+def _answer_directly(user_query: str):
+    """Answers single-tool questions without the crew. Returns None when the crew is needed."""
+    try:
+        route = _route_query(user_query)
+    except Exception:
+        logger.warning("Query routing failed; using the full crew", exc_info=True)
+        return None
+
+    dispatch = ROUTE_TOOLS.get(route.route)
+    if dispatch is None:
+        return None
+    needed_arg, run_tool = dispatch
+    if needed_arg and not getattr(route, needed_arg):
+        return None
+    tool_output = run_tool(route)
+
+    # Routing only needs the fast model; the user-facing answer gets the reasoning model
+    return str(llm_reasoning.call([
+        {"role": "system", "content": ANSWER_PROMPT},
+        {"role": "user", "content": f"Question: {user_query}\n\nTool output:\n{json.dumps(tool_output, default=str)}"}
+    ]))
+
 # --- Task Execution Logic ---
 
-def get_ai_response(history: list):
-    user_query = history[-1]['content'] if history else ""
-    
+CREW_AGENTS = [market_analyst, portfolio_specialist, data_ingester, analytics_agent, trading_agent, visual_agent, sql_agent]
+
+ANALYSIS_TASK_TEMPLATE = """Answer the user query: '{user_query}'.
+        Rules:
+        - Holdings/portfolio questions: use 'get_portfolio_analysis'; never invent data; empty result means empty portfolio.
+        - Past dates or date comparisons: use 'get_historical_holdings' per date and compare total value, top holdings and diversification; month-over-month transaction questions go to the 'sql_agent'.
+        - Market prices: state whether they are 'Live Market Data' or 'mock_data'.
+        """
+
+ANALYSIS_EXPECTED_OUTPUT = "A helpful response based ONLY on the actual database usage and tool outputs. It must EXPLICITLY mention the data source (Live Market Data or mock_data) if market prices were involved, and end with a follow-up question."
+
+# Unambiguous requests go straight to one specialist (sequential process, no manager round trip).
+# Imperatives only: "what did I buy in May" is analysis, "buy 5 TCS at 3500" is an order.
+# The trading agent has no lookup tools, so orders skip the crew only when both the quantity and
+# the price are spelled out; "sell all my TCS" or "buy 10 TCS" without a price need the held
+# quantity or a quote from the other agents first.
+SPECIALIST_PATTERNS = [
+    (re.compile(r"^\s*(please\s+)?(buy|sell|place)\b.*?\b\d+(\.\d+)?\b.*?(@|\bat\b|\bprice\b|₹|\brs\b\.?)\s*[\d,.]*\d",
+                re.IGNORECASE), trading_agent),
+    (re.compile(r"^\s*(please\s+)?(delete|remove)\b", re.IGNORECASE), trading_agent),
+    (re.compile(r"\bsql\b", re.IGNORECASE), sql_agent),
+]
+
+def _pick_specialist(user_query: str):
+    for pattern, agent in SPECIALIST_PATTERNS:
+        if pattern.search(user_query):
+            return agent
+    return None
+
+def _run_specialist(user_query: str, agent) -> str:
+    task = Task(
+        description=ANALYSIS_TASK_TEMPLATE.format(user_query=user_query),
+        expected_output=ANALYSIS_EXPECTED_OUTPUT,
+        agent=agent
+    )
+    crew = Crew(agents=[agent], tasks=[task], process=Process.sequential, verbose=CREW_VERBOSE)
+    return str(crew.kickoff())
+
+def _run_crew(user_query: str) -> str:
     # In a hierarchical process, we do NOT assign a specific agent to the task.
     # The manager LLM decides which agent to delegate to.
     analysis_task = Task(
-        description=f"""Process the user query: '{user_query}' while considering history context.
-        
-        CRITICAL RULES:
-        1. If the user asks about holdings, portfolio, or investments, you MUST use the 'get_portfolio_analysis' tool. 
-           - Do NOT provide a generic example or hallucinated data.
-           - If the tool returns no holdings, state that the portfolio is empty.
-        2. COMPARISON/HISTORICAL: If the user asks to compare dates or asks for state at a specific past date, you MUST use 'get_historical_holdings' with the appropriate date strings. 
-           - For complex transaction comparisons (e.g., month over month), utilize the 'sql_agent' to query the "transaction" table directly for precise results.
-           - Calculate differences in total value, top holdings, and diversification between the points.
-        3. If you fetch market prices, you MUST explicitly state whether the data is from 'Live Market Data' or if it is 'mock_data'.
-           - Do not omit this information. The user needs to know the data source.
-        """,
-        expected_output="A helpful response based ONLY on the actual database usage and tool outputs. It must EXPLICITLY mention the data source (Live Market Data or mock_data) if market prices were involved, and end with a follow-up question.",
+        description=ANALYSIS_TASK_TEMPLATE.format(user_query=user_query),
+        expected_output=ANALYSIS_EXPECTED_OUTPUT,
         # agent=analytics_agent  <-- Removed to allow hierarchical delegation
     )
 
+    # Task and Crew are rebuilt per request on purpose: construction is sub-millisecond, and a hierarchical
+    # crew cannot be kicked off twice (its manager agent keeps the delegation tools from the first run)
     crew = Crew(
-        agents=[market_analyst, portfolio_specialist, data_ingester, analytics_agent, trading_agent, visual_agent, sql_agent],
+        agents=CREW_AGENTS,
         tasks=[analysis_task],
         process=Process.hierarchical, # Use hierarchical process for dynamic routing
         manager_llm=llm_fast, # Use fast model for routing
-        verbose=True
+        verbose=CREW_VERBOSE
     )
 
+    return str(crew.kickoff())
+
+def get_ai_response(history: list):
+    # Identical conversations get identical answers (temperature=0), so serve repeats from cache
+    cache_key = hashlib.blake2b(json.dumps(history, sort_keys=True, default=str).encode()).hexdigest()
+    cached = get_cached(ai_response_cache, cache_key)
+    if cached is not None:
+        return cached
+    portfolio_version = get_portfolio_version()
+
+    user_query = history[-1]['content'] if history else ""
+
     try:
-        result = crew.kickoff()
-        return str(result)
+        specialist = _pick_specialist(user_query)
+        if specialist is not None:
+            result = _run_specialist(user_query, specialist)
+        else:
+            result = _answer_directly(user_query)
+            if result is None:
+                result = _run_crew(user_query)
     except Exception as e:
-        print(f"CrewAI Error: {e}")
+        logger.exception("Chat response failed")
         return f"Error: {str(e)}"
+
+    # Don't cache runs that placed or deleted orders; replaying them must hit the tools again
+    if get_portfolio_version() == portfolio_version:
+        set_cached(ai_response_cache, cache_key, result)
+    return result
@@ -0,0 +1,53 @@
+from threading import Lock
+from cachetools import TTLCache, LRUCache
+
+# Response caches for the analytics endpoints. Entries expire on their own,
+# and are dropped whenever transactions change (see invalidate_portfolio_caches).
+valuation_history_cache = TTLCache(maxsize=1, ttl=3600)
+xirr_projection_cache = TTLCache(maxsize=32, ttl=30)
+
+# Agent portfolio summary; only changes when transactions/holdings do
+portfolio_analysis_cache = TTLCache(maxsize=1, ttl=3600)
+
+# Live quotes per symbol, so overlapping requests within a minute skip the network
+live_price_cache = TTLCache(maxsize=1000, ttl=60)
+
+# Daily close history per (symbols, start, end); independent of transactions, so only expires
+price_history_cache = TTLCache(maxsize=32, ttl=3600)
+
+# Parsed workbook sheets keyed by (content hash, read options); re-uploading the same statement skips parsing
+parsed_sheet_cache = LRUCache(maxsize=16)
+
+# Final chat answers keyed by a hash of the conversation; short-lived since answers may quote live prices
+ai_response_cache = TTLCache(maxsize=128, ttl=60)
+
+# Last successfully computed valuation history, served when yfinance is unreachable
+stale_valuation_history = {}
+
+_cache_lock = Lock()
+
+# Bumped on every invalidation, so callers can tell whether the portfolio changed while they worked
+_portfolio_version = 0
+
+def get_cached(cache, key):
+    with _cache_lock:
+        return cache.get(key)
+
+def set_cached(cache, key, value):
+    with _cache_lock:
+        cache[key] = value
+
+def invalidate_portfolio_caches():
+    """Drops every cached response derived from transactions/holdings."""
+    global _portfolio_version
+    with _cache_lock:
+        valuation_history_cache.clear()
+        xirr_projection_cache.clear()
+        stale_valuation_history.clear()
+        ai_response_cache.clear()
+        portfolio_analysis_cache.clear()
+        _portfolio_version += 1
+
+def get_portfolio_version():
+    with _cache_lock:
+        return _portfolio_version
@@ -1,16 +1,46 @@
 import os
 from sqlmodel import create_engine, SQLModel, Session
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
 
 BASE_DIR = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
 DATABASE_PATH = os.path.join(BASE_DIR, "portfolio_v2.db")
 DATABASE_URL = f"sqlite:///{DATABASE_PATH}"
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+# Size the pool for concurrent FastAPI worker threads instead of relying on the 5+10 default
+engine = create_engine(
+    DATABASE_URL,
+    # cached_statements: prepared statements kept per connection (default 128), so repeated agent SQL skips re-parsing;
+    # timeout: wait up to 30 s for a competing writer's lock instead of failing with "database is locked" after 5 s
+    connect_args={"check_same_thread": False, "cached_statements": 256, "timeout": 30},
+    pool_size=20,
+    max_overflow=40,
+    pool_pre_ping=True,
+)
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets readers run alongside an ingest and, with synchronous=NORMAL, only fsyncs at
+    # checkpoints instead of on every commit; temp B-trees and a 64 MB page cache stay in memory,
+    # and reads go through a 256 MB memory map rather than read() syscalls
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-65536")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.close()
+
+# Objects stay loaded after commit, so returning them doesn't trigger a refresh SELECT per row
+SessionLocal = sessionmaker(bind=engine, class_=Session, expire_on_commit=False)
 
 def create_db_and_tables():
     from .models import Transaction, Holding
     SQLModel.metadata.create_all(engine)
+    # Planner statistics for the indexes above; cheap on a portfolio-sized database
+    with engine.begin() as conn:
+        conn.exec_driver_sql("ANALYZE")
 
 def get_session():
-    with Session(engine) as session:
+    with SessionLocal() as session:
         yield session
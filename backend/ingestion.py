@@ -1,8 +1,13 @@
+import hashlib
 import pandas as pd
+import numpy as np
 from datetime import datetime
-from sqlmodel import Session, select
+from sqlmodel import Session, select, or_
+from sqlalchemy import insert, delete, func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from .models import Transaction, Holding
-from .database import engine
+from .database import SessionLocal
+from .cache import invalidate_portfolio_caches, get_cached, set_cached, parsed_sheet_cache
 from typing import List, Dict, Optional, Tuple
 
 # Mapping for Mutual Fund Scheme Names to Yahoo Finance Tickers
@@ -11,9 +16,72 @@ MF_TICKER_MAP = {
     # Add more mappings here as needed
 }
 
+# Date layout of the "Date" column in mutual fund order statements, e.g. "19 Jan 2026"
+MF_DATE_FORMAT = '%d %b %Y'
+
+# Ticker -> scheme name, built once (first scheme wins if two share a ticker)
+MF_NAME_BY_TICKER = {}
+for _name, _ticker in MF_TICKER_MAP.items():
+    MF_NAME_BY_TICKER.setdefault(_ticker, _name)
+
+def _read_excel(file_path: str, **kwargs) -> pd.DataFrame:
+    """
+    Reads a workbook sheet, reusing the parsed frame when identical file content was read
+    with the same options before (uploads land in fresh temp files, so key on content, not path).
+    """
+    with open(file_path, "rb") as fh:
+        digest = hashlib.sha1(fh.read()).hexdigest()
+    key = (digest, tuple(sorted(kwargs.items())))
+    parsed = get_cached(parsed_sheet_cache, key)
+    if parsed is None:
+        parsed = _parse_excel(file_path, **kwargs)
+        set_cached(parsed_sheet_cache, key, parsed)
+    # Callers normalize the frame in place, so never hand out the cached object
+    return parsed.copy()
+
+def _parse_excel(file_path: str, **kwargs) -> pd.DataFrame:
+    """
+    Parses a workbook with the Rust calamine engine when available, otherwise with
+    openpyxl in read-only mode (no styles/DOM), which is still much faster than the default.
+    """
+    try:
+        return pd.read_excel(file_path, engine="calamine", **kwargs)
+    except ImportError:
+        return pd.read_excel(
+            file_path,
+            engine="openpyxl",
+            engine_kwargs={"read_only": True, "data_only": True, "keep_links": False},
+            **kwargs
+        )
+
+def _clean_numeric(values: pd.Series) -> pd.Series:
+    """
+    Parses an exported numeric column in one vectorized pass: thousands separators are
+    stripped and blanks, '-' or anything unparseable become 0.0.
+    """
+    parsed = pd.to_numeric(values, errors='coerce')
+    unparsed = parsed.isna() & values.notna()
+    if unparsed.any():
+        # Only text cells need cleaning; numbers are taken as-is to keep full precision
+        text = values[unparsed].astype(str).str.replace(',', '', regex=False).str.strip()
+        parsed = parsed.astype(float)
+        parsed[unparsed] = pd.to_numeric(text, errors='coerce')
+    return parsed.fillna(0.0).astype(float)
+
+def _parse_dates(values: pd.Series, date_format: str) -> pd.Series:
+    """
+    Parses a date column with its known export format (cache=True parses each distinct string once).
+    Cells in any other layout fall back to pandas' inference; unparseable ones become NaT.
+    """
+    parsed = pd.to_datetime(values, format=date_format, errors='coerce', cache=True)
+    unparsed = parsed.isna() & values.notna()
+    if unparsed.any():
+        parsed[unparsed] = pd.to_datetime(values[unparsed], errors='coerce', cache=True)
+    return parsed
+
 def ingest_excel(file_path: str):
     # Peek at the file to determine type
-    peek_df = pd.read_excel(file_path, nrows=20)
+    peek_df = _read_excel(file_path, nrows=20)
     is_mf_holdings = any(peek_df.iloc[:, 0].astype(str).str.contains("HOLDING SUMMARY|HOLDINGS AS ON", na=False))
     is_mf_orders = any(peek_df.iloc[:, 0].astype(str).str.contains("TRANSACTIONS FROM", na=False))
     
@@ -22,7 +90,7 @@ def ingest_excel(file_path: str):
         return
 
     # Header is at row 5 (0-indexed) for Stocks
-    df = pd.read_excel(file_path, header=5)
+    df = _read_excel(file_path, header=5)
     
     # Rename columns to match model
     column_mapping = {
@@ -45,65 +113,45 @@ def ingest_excel(file_path: str):
     # Convert execution_time to datetime
     df['execution_time'] = pd.to_datetime(df['execution_time'], format='%d-%m-%Y %I:%M %p')
     
-    with Session(engine) as session:
-        for _, row in df.iterrows():
-            # Check if transaction already exists
-            existing = session.exec(select(Transaction).where(Transaction.order_id == str(row['order_id']))).first()
-            if not existing:
-                transaction = Transaction(
-                    stock_name=row['stock_name'],
-                    symbol=row['symbol'],
-                    isin=row['isin'],
-                    type=row['type'],
-                    quantity=row['quantity'],
-                    price=row['price'],
-                    exchange=row['exchange'],
-                    order_id=str(row['order_id']),
-                    execution_time=row['execution_time'],
-                    geography="India",
-                    category="Commodity" if str(row['symbol']).upper() == "GOLDBEES" else "Equity(Stocks)",
-                    status=row['status']
-                )
-                session.add(transaction)
-        
-        session.commit()
-        update_holdings(session)
+    df['order_id'] = df['order_id'].map(str)
+    df['category'] = df['symbol'].map(str).str.upper().eq("GOLDBEES").map({True: "Commodity", False: "Equity(Stocks)"})
+    
+    with SessionLocal() as session:
+        # Resolve already-ingested orders in one query instead of one SELECT per row
+        existing_ids = set(session.exec(
+            select(Transaction.order_id).where(Transaction.order_id.in_(df['order_id'].unique().tolist()))
+        ).all())
+        new_rows = df[~df['order_id'].isin(existing_ids)].drop_duplicates('order_id')
+        tx_columns = ['stock_name', 'symbol', 'isin', 'type', 'quantity', 'price', 'exchange',
+                      'order_id', 'execution_time', 'category', 'status']
+        new_transactions = [
+            Transaction(**record, geography="India") for record in new_rows[tx_columns].to_dict('records')
+        ]
+        add_transactions_bulk(session, new_transactions)
 
 def ingest_mutual_funds(file_path: str, is_orders: bool):
     # Find header row dynamically
-    df_raw = pd.read_excel(file_path, header=None, nrows=30)
+    df_raw = _read_excel(file_path, header=None, nrows=30)
     header_row = -1
     target_keyword = "Scheme Name"
-    for i, row in df_raw.iterrows():
-        if any(target_keyword in str(val) for val in row if pd.notna(val)):
-            header_row = i
-            break
+    # Mark every non-empty cell containing the keyword in one C-level pass over a plain
+    # string array (no per-column Series), then take the first such row
+    cells = df_raw.to_numpy(dtype=str)
+    has_keyword = (np.char.find(cells, target_keyword) >= 0) & df_raw.notna().to_numpy()
+    keyword_rows = has_keyword.any(axis=1)
+    if keyword_rows.any():
+        header_row = int(keyword_rows.argmax())
     
     if header_row == -1:
         # Fallback to defaults if not found
         header_row = 10 if is_orders else 19
         
-    df = pd.read_excel(file_path, header=header_row)
-    
-    # Clean numeric columns (handle commas and strings)
-    def clean_numeric(val):
-        if pd.isna(val): return 0.0
-        if isinstance(val, (int, float)): return float(val)
-        if isinstance(val, str):
-            val = val.replace(',', '').strip()
-            if not val or val == '-': return 0.0
-            try:
-                return float(val)
-            except:
-                return 0.0
-        return 0.0
-
-    mf_prices_from_file = {}
+    df = _read_excel(file_path, header=header_row)
+    # Normalize column names once for both statement layouts
+    df.columns = [str(c).strip() for c in df.columns]
 
     if is_orders:
         # Normalize Order History
-        df.columns = [str(c).strip() for c in df.columns]
-        
         col_map = {
             'Scheme Name': 'stock_name',
             'Type': 'type',
@@ -125,19 +173,22 @@ def ingest_mutual_funds(file_path: str, is_orders: bool):
                 'Unnamed: 5': 'execution_time'
             })
             
-        df = df[df['stock_name'].notna() & (df['stock_name'].astype(str).str.contains("Scheme Name") == False)]
-        df['stock_name'] = df['stock_name'].astype(str).str.strip()
-        df['quantity'] = df['quantity'].apply(clean_numeric)
-        df['price'] = df['price'].apply(clean_numeric)
+        # Stringify the scheme column once; it drives both the row filter and the stored name
+        names = df['stock_name'].astype(str)
+        keep = df['stock_name'].notna() & ~names.str.contains("Scheme Name", regex=False)
+        df = df[keep]
+        df['stock_name'] = names[keep].str.strip()
+        df['quantity'] = _clean_numeric(df['quantity'])
+        df['price'] = _clean_numeric(df['price'])
         if 'total_value' in df.columns:
-            df['total_value'] = df['total_value'].apply(clean_numeric)
+            df['total_value'] = _clean_numeric(df['total_value'])
         
         if 'type' in df.columns:
             df['type'] = df['type'].astype(str).str.upper().map({'PURCHASE': 'BUY', 'REDEMPTION': 'SELL'}).fillna('BUY')
         else:
             df['type'] = 'BUY'
             
-        df['execution_time'] = pd.to_datetime(df['execution_time'], errors='coerce')
+        df['execution_time'] = _parse_dates(df['execution_time'], MF_DATE_FORMAT)
         df = df[df['execution_time'].notna()]
         
         df['status'] = 'Executed'
@@ -147,71 +198,74 @@ def ingest_mutual_funds(file_path: str, is_orders: bool):
         df['symbol'] = df['stock_name'].map(MF_TICKER_MAP).fillna(df['stock_name'])
         df['isin'] = 'MF_ISIN'
         df['folio_number'] = 'MF_FOLIO'
-        
-        with Session(engine) as session:
-            for _, row in df.iterrows():
-                pseudo_id = f"MF_{row['execution_time'].strftime('%Y%m%d')}_{row['stock_name']}"
-                existing = session.exec(select(Transaction).where(Transaction.order_id == pseudo_id)).first()
-                if not existing:
-                    transaction = Transaction(
-                        stock_name=row['stock_name'],
-                        symbol=row['symbol'],
-                        isin=row['isin'],
-                        type=row['type'],
-                        quantity=row['quantity'],
-                        price=row['total_value'], # Use total amount here
-                        exchange=row['exchange'],
-                        order_id=pseudo_id,
-                        execution_time=row['execution_time'],
-                        geography="India",
-                        category="Mutual Fund",
-                        folio_number=row['folio_number'],
-                        status=row['status']
-                    )
-                    session.add(transaction)
-            session.commit()
-            update_holdings(session)
+        df['order_id'] = "MF_" + df['execution_time'].dt.strftime('%Y%m%d') + "_" + df['stock_name']
+
+        with SessionLocal() as session:
+            new_transactions = []
+            # Resolve already-ingested orders in one query instead of one SELECT per row
+            existing_ids = set(session.exec(
+                select(Transaction.order_id).where(Transaction.order_id.in_(df['order_id'].tolist()))
+            ).all())
+            new_rows = df[~df['order_id'].isin(existing_ids)].drop_duplicates('order_id')
+            new_rows = new_rows.assign(price=new_rows['total_value'])  # Use total amount here
+            tx_columns = ['stock_name', 'symbol', 'isin', 'type', 'quantity', 'price', 'exchange',
+                          'order_id', 'execution_time', 'folio_number', 'status']
+            for record in new_rows[tx_columns].to_dict('records'):
+                new_transactions.append(Transaction(**record, geography="India", category="Mutual Fund"))
+            add_transactions_bulk(session, new_transactions)
     else:
         # Normalize Holdings
-        df.columns = [str(c).strip() for c in df.columns]
         scheme_col = next((c for c in df.columns if 'Scheme' in c), 'Scheme Name')
         folio_col = next((c for c in df.columns if 'Folio' in c), None)
         units_col = next((c for c in df.columns if 'Units' in c), None)
         value_col = next((c for c in df.columns if 'Invested' in c), None)
         cur_val_col = next((c for c in df.columns if 'Current Value' in c), None)
         
-        df = df[df[scheme_col].notna() & (df[scheme_col].astype(str).str.contains("Scheme Name") == False)]
+        scheme_names = df[scheme_col].astype(str)
+        keep = df[scheme_col].notna() & ~scheme_names.str.contains("Scheme Name", regex=False)
+        df = df[keep]
         
-        with Session(engine) as session:
-            for _, row in df.iterrows():
-                scheme = str(row[scheme_col]).strip()
-                folio = str(row[folio_col]).strip() if folio_col and pd.notna(row[folio_col]) else "MF_FOLIO"
-                
-                # Extract pricing info for persistence
-                units = clean_numeric(row[units_col]) if units_col else 0.0
-                current_valuation = clean_numeric(row[cur_val_col]) if cur_val_col else 0.0
-                current_price = current_valuation / units if units > 0 else None
-                if current_price:
-                    mf_prices_from_file[(scheme, folio)] = current_price
-                
+        # Normalize the per-row fields up front instead of cell by cell inside the loop
+        schemes_col = scheme_names[keep].str.strip()
+        if folio_col:
+            folios_col = df[folio_col].astype(str).str.strip().where(df[folio_col].notna(), "MF_FOLIO")
+        else:
+            folios_col = pd.Series("MF_FOLIO", index=df.index)
+        zeros = pd.Series(0.0, index=df.index)
+        units_values = _clean_numeric(df[units_col]) if units_col else zeros
+        cur_values = _clean_numeric(df[cur_val_col]) if cur_val_col else zeros
+        invested_values = _clean_numeric(df[value_col]) if value_col else zeros
+        
+        # Extract pricing info for persistence: NAV = current value / units, per (scheme, folio)
+        navs = cur_values.div(units_values).where(units_values > 0)
+        has_nav = navs.notna() & navs.ne(0)
+        mf_prices_from_file = dict(zip(zip(schemes_col[has_nav], folios_col[has_nav]), navs[has_nav]))
+        
+        with SessionLocal() as session:
+            new_transactions = []
+            # Load every transaction for the schemes in this file once, keyed by (symbol, folio)
+            schemes = schemes_col.unique().tolist()
+            tx_by_key = {}
+            for tx in session.exec(select(Transaction).where(Transaction.symbol.in_(schemes))).all():
+                tx_by_key.setdefault((tx.symbol, tx.folio_number), []).append(tx)
+
+            for scheme, folio, units, invested in zip(schemes_col, folios_col, units_values, invested_values):
                 # 1. Update existing "MF_FOLIO" transactions for this scheme with the real folio
                 if folio != "MF_FOLIO":
-                    existing_placeholders = session.exec(
-                        select(Transaction).where(Transaction.symbol == scheme, Transaction.folio_number == "MF_FOLIO")
-                    ).all()
+                    existing_placeholders = tx_by_key.pop((scheme, "MF_FOLIO"), [])
                     for tx in existing_placeholders:
                         tx.folio_number = folio
                         session.add(tx)
-                    session.flush() 
+                    if existing_placeholders:
+                        # In-place edit the holdings signature can't see
+                        _mark_holdings_changed()
+                    tx_by_key.setdefault((scheme, folio), []).extend(existing_placeholders)
                 
                 # 2. Check if we already have transactions for this scheme to avoid double counting
-                has_tx = session.exec(
-                    select(Transaction).where(Transaction.symbol == scheme, Transaction.folio_number == folio)
-                ).first()
+                has_tx = tx_by_key.get((scheme, folio))
                 
                 if not has_tx:
                     pseudo_id = f"MF_HOLDING_{folio}_{scheme}"
-                    invested = clean_numeric(row[value_col]) if value_col else 0.0
                     
                     # Use ticker mapping
                     ticker = MF_TICKER_MAP.get(scheme, scheme)
@@ -231,93 +285,209 @@ def ingest_mutual_funds(file_path: str, is_orders: bool):
                         folio_number=folio,
                         status="Executed"
                     )
-                    session.add(transaction)
-                    session.flush()
-            session.commit()
-            update_holdings(session, mf_prices=mf_prices_from_file)
+                    new_transactions.append(transaction)
+                    tx_by_key.setdefault((ticker, folio), []).append(transaction)
+            add_transactions_bulk(session, new_transactions, mf_prices=mf_prices_from_file)
+
+def add_transactions_bulk(session: Session, transactions: List[Transaction], mf_prices: Dict[Tuple[str, str], float] = None):
+    """Persists a batch of new transactions with one executemany INSERT and a single holdings resync, in one commit."""
+    if transactions:
+        # Core insert skips per-object unit-of-work bookkeeping; pending edits to loaded rows flush before the resync reads
+        session.execute(insert(Transaction), [tx.model_dump(exclude={"id"}) for tx in transactions])
+    # update_holdings commits the inserts together with the holdings they produce
+    update_holdings(session, mf_prices=mf_prices)
+
+class _Position:
+    """Running position for one (symbol, folio) while replaying transactions."""
+    __slots__ = ('symbol', 'stock_name', 'isin', 'geography', 'category', 'folio_number',
+                 'current_quantity', 'total_invested', 'last_transaction_date')
+
+    def __init__(self, symbol, stock_name, isin, geography, category, folio_number, first_date):
+        self.symbol = symbol
+        self.stock_name = stock_name
+        self.isin = isin
+        self.geography = geography
+        self.category = category
+        self.folio_number = folio_number
+        self.current_quantity = 0.0
+        self.total_invested = 0.0
+        self.last_transaction_date = first_date
+
+# Signature of the tables the holdings were last rebuilt from, so a resync with nothing new is a no-op
+_holdings_signature = None
+
+def _transaction_signature(session: Session) -> tuple:
+    """Row count, newest id/time and total quantity of the transaction table; moves with every insert or delete."""
+    return tuple(session.exec(select(
+        func.count(Transaction.id), func.max(Transaction.id), func.max(Transaction.execution_time),
+        func.total(Transaction.quantity)
+    )).one())
+
+def _holding_count(session: Session) -> int:
+    return session.exec(select(func.count(Holding.id))).one()
+
+def _mark_holdings_changed():
+    """
+    Must follow every write to transactions or holdings that bypasses update_holdings' rebuild:
+    the next update_holdings then rebuilds instead of trusting the signature, and responses
+    derived from the old rows are dropped.
+    """
+    global _holdings_signature
+    _holdings_signature = None
+    invalidate_portfolio_caches()
 
 def update_holdings(session: Session, mf_prices: Dict[Tuple[str, str], float] = None):
-    transactions = session.exec(select(Transaction)).all()
+    """
+    Rebuilds holdings from the transaction history and commits. Transaction writes the caller
+    left uncommitted in the session are replayed and committed with it, in one write transaction.
+    """
+    global _holdings_signature
+    # Taken before the replay read, so a concurrent insert can only force the next call to rebuild.
+    # The holding count catches the table being rebuilt or emptied by another process.
+    transaction_signature = _transaction_signature(session)
+    if not mf_prices and (transaction_signature, _holding_count(session)) == _holdings_signature:
+        # Nothing to rebuild, but the caller may have staged writes; commit them and drop
+        # derived responses as a full resync would
+        session.commit()
+        invalidate_portfolio_caches()
+        return
+
+    # Plain row tuples with only the replayed columns; no ORM objects for the full history
+    rows = session.exec(
+        select(Transaction.symbol, Transaction.folio_number, Transaction.type, Transaction.quantity,
+               Transaction.price, Transaction.execution_time, Transaction.stock_name, Transaction.isin,
+               Transaction.geography, Transaction.category).order_by(Transaction.id)
+    ).all()
     holdings_dict = {}
     
-    for tx in transactions:
-        key = (tx.symbol, tx.folio_number)
-        if key not in holdings_dict:
-            holdings_dict[key] = {
-                'symbol': tx.symbol,
-                'stock_name': tx.stock_name,
-                'isin': tx.isin,
-                'current_quantity': 0.0,
-                'total_invested': 0.0,
-                'geography': tx.geography,
-                'category': tx.category,
-                'folio_number': tx.folio_number,
-                'last_transaction_date': tx.execution_time
-            }
+    for symbol, folio_number, tx_type, quantity, amount, executed_at, stock_name, isin, geography, category in rows:
+        key = (symbol, folio_number)
+        position = holdings_dict.get(key)
+        if position is None:
+            position = holdings_dict[key] = _Position(symbol, stock_name, isin, geography, category, folio_number, executed_at)
         
-        if tx.type.upper() == 'BUY':
-            holdings_dict[key]['current_quantity'] += tx.quantity
-            holdings_dict[key]['total_invested'] += tx.price 
+        if tx_type.upper() == 'BUY':
+            position.current_quantity += quantity
+            position.total_invested += amount
         else:
-            if holdings_dict[key]['current_quantity'] > 0:
-                reduction_ratio = tx.quantity / holdings_dict[key]['current_quantity']
-                holdings_dict[key]['total_invested'] *= (1 - reduction_ratio)
-            holdings_dict[key]['current_quantity'] -= tx.quantity
+            if position.current_quantity > 0:
+                reduction_ratio = quantity / position.current_quantity
+                position.total_invested *= (1 - reduction_ratio)
+            position.current_quantity -= quantity
             
-        if tx.execution_time > holdings_dict[key]['last_transaction_date']:
-            holdings_dict[key]['last_transaction_date'] = tx.execution_time
+        if executed_at > position.last_transaction_date:
+            position.last_transaction_date = executed_at
 
-    existing_holdings = session.exec(select(Holding)).all()
-    existing_keys = {(h.symbol, h.folio_number): h for h in existing_holdings}
-    calculated_keys = set(holdings_dict.keys())
+    existing_ids = {(symbol, folio): holding_id for holding_id, symbol, folio in
+                    session.exec(select(Holding.id, Holding.symbol, Holding.folio_number)).all()}
 
-    # Update or Add holdings
+    now = datetime.now()
+    records = []
     for key, data in holdings_dict.items():
-        if data['current_quantity'] <= 0:
-            if key in existing_keys:
-                session.delete(existing_keys[key])
+        if data.current_quantity <= 0:
             continue
+        holding_id = existing_ids.pop(key, None)
+        # Price fields stay None unless the file carried an MF price; the upsert keeps the stored ones then
+        price = mf_prices.get(key) if mf_prices else None
+        records.append({
+            'id': holding_id,
+            'symbol': data.symbol,
+            'stock_name': data.stock_name,
+            'isin': data.isin,
+            'quantity': data.current_quantity,
+            'avg_price': data.total_invested / data.current_quantity,
+            'total_invested': data.total_invested,
+            'current_price': price,
+            'current_valuation': price * data.current_quantity if price is not None else None,
+            'geography': data.geography,
+            'category': data.category,
+            'folio_number': data.folio_number,
+            'last_transaction_date': data.last_transaction_date,
+            'last_updated_at': now if holding_id is None or price is not None else None,
+        })
 
-        if key in existing_keys:
-            holding = existing_keys[key]
-            holding.quantity = data['current_quantity']
-            holding.total_invested = data['total_invested']
-            holding.avg_price = data['total_invested'] / data['current_quantity'] if data['current_quantity'] > 0 else 0
-            holding.last_transaction_date = data['last_transaction_date']
-            holding.stock_name = data['stock_name']
-            holding.isin = data['isin']
-            holding.geography = data['geography']
-            holding.category = data['category']
-        else:
-            holding = Holding(
-                symbol=data['symbol'],
-                stock_name=data['stock_name'],
-                isin=data['isin'],
-                quantity=data['current_quantity'],
-                avg_price=data['total_invested'] / data['current_quantity'] if data['current_quantity'] > 0 else 0,
-                total_invested=data['total_invested'],
-                geography=data['geography'],
-                category=data['category'],
-                folio_number=data['folio_number'],
-                last_transaction_date=data['last_transaction_date'],
-                last_updated_at=datetime.now()
-            )
-            session.add(holding)
-
-        # Apply MF prices from file if provided
-        if mf_prices and key in mf_prices:
-            holding.current_price = mf_prices[key]
-            holding.current_valuation = holding.current_price * holding.quantity
-            holding.last_updated_at = datetime.now()
-            
-    # Cleanup: Delete holdings no longer in transactions
-    for key in (set(existing_keys.keys()) - calculated_keys):
-        session.delete(existing_keys[key])
+    # (symbol, folio) isn't unique (NULL folios never conflict), so rows upsert on their id:
+    # known positions carry their holding id, new ones get a fresh one
+    if records:
+        stmt = sqlite_insert(Holding).values(records)
+        excluded = stmt.excluded
+        stmt = stmt.on_conflict_do_update(index_elements=['id'], set_={
+            'stock_name': excluded.stock_name,
+            'isin': excluded.isin,
+            'quantity': excluded.quantity,
+            'avg_price': excluded.avg_price,
+            'total_invested': excluded.total_invested,
+            'current_price': func.coalesce(excluded.current_price, Holding.current_price),
+            'current_valuation': func.coalesce(excluded.current_valuation, Holding.current_valuation),
+            'geography': excluded.geography,
+            'category': excluded.category,
+            'last_transaction_date': excluded.last_transaction_date,
+            'last_updated_at': func.coalesce(excluded.last_updated_at, Holding.last_updated_at),
+        })
+        session.execute(stmt)
+
+    # Whatever is left was sold out or no longer has transactions
+    if existing_ids:
+        session.execute(delete(Holding).where(Holding.id.in_(list(existing_ids.values()))))
             
+    signature = (transaction_signature, _holding_count(session))
     session.commit()
+    _holdings_signature = signature
+    invalidate_portfolio_caches()
 
 import random
 
+def _apply_to_holding(session: Session, tx: Transaction) -> bool:
+    """
+    Applies one new transaction to its position's holding row the way update_holdings would replay it.
+    Returns False when the stored holdings can't represent the running position (a flat or short
+    position with earlier transactions, or duplicate rows) and a full replay is needed.
+    """
+    key_filter = (Holding.symbol == tx.symbol, Holding.folio_number == tx.folio_number)
+    matches = session.exec(select(Holding).where(*key_filter)).all()
+    if len(matches) > 1:
+        return False
+    if not matches:
+        has_history = session.exec(select(Transaction.id).where(
+            Transaction.symbol == tx.symbol, Transaction.folio_number == tx.folio_number).limit(1)).first()
+        if has_history is not None:
+            return False
+        quantity, invested = float(tx.quantity), float(tx.price)
+        if tx.type.upper() == 'BUY' and quantity > 0:
+            session.add(Holding(
+                symbol=tx.symbol,
+                stock_name=tx.stock_name,
+                isin=tx.isin,
+                quantity=quantity,
+                avg_price=invested / quantity,
+                total_invested=invested,
+                geography=tx.geography,
+                category=tx.category,
+                folio_number=tx.folio_number,
+                last_transaction_date=tx.execution_time,
+                last_updated_at=datetime.now()
+            ))
+        # A first SELL opens a short position, which has no holding row
+        return True
+
+    holding = matches[0]
+    if holding.quantity <= 0:
+        return False
+    if tx.type.upper() == 'BUY':
+        holding.quantity += tx.quantity
+        holding.total_invested += tx.price
+    else:
+        holding.total_invested *= (1 - tx.quantity / holding.quantity)
+        holding.quantity -= tx.quantity
+    if holding.last_transaction_date is None or tx.execution_time > holding.last_transaction_date:
+        holding.last_transaction_date = tx.execution_time
+
+    if holding.quantity <= 0:
+        session.delete(holding)
+    else:
+        holding.avg_price = holding.total_invested / holding.quantity
+    return True
+
 def add_manual_transaction(session: Session, symbol: str, tx_type: str, quantity: float, price: float, exchange: str, stock_name: str = None, isin: str = None, geography: str = "India", category: str = "Equity(Stocks)", folio_number: str = None):
     # Reverse map for ticker to name lookup if needed, or vice-versa
     if category == "Mutual Fund":
@@ -327,25 +497,21 @@ def add_manual_transaction(session: Session, symbol: str, tx_type: str, quantity
             symbol = MF_TICKER_MAP[symbol]
         # If symbol is already a ticker but name is missing, try to find name
         elif not stock_name:
-            for name, ticker in MF_TICKER_MAP.items():
-                if ticker == symbol:
-                    stock_name = name
-                    break
+            stock_name = MF_NAME_BY_TICKER.get(symbol)
 
     # Auto-fetch metadata from existing holdings if not provided
     if not stock_name or not isin:
-        # Try finding by symbol first
-        query = select(Holding).where(Holding.symbol == symbol)
+        # Match by symbol, and for Mutual Funds also by name (in case symbol was the name),
+        # in a single query; a symbol match takes precedence
+        match_by_name = category == "Mutual Fund" and stock_name
+        condition = or_(Holding.symbol == symbol, Holding.stock_name == stock_name) if match_by_name else Holding.symbol == symbol
+        query = select(Holding).where(condition)
         if folio_number:
             query = query.where(Holding.folio_number == folio_number)
-        existing_holding = session.exec(query).first()
-        
-        # If not found by symbol, and it's a Mutual Fund, try finding by name if symbol was the name
-        if not existing_holding and category == "Mutual Fund" and stock_name:
-            query = select(Holding).where(Holding.stock_name == stock_name)
-            if folio_number:
-                query = query.where(Holding.folio_number == folio_number)
-            existing_holding = session.exec(query).first()
+        candidates = session.exec(query).all()
+        existing_holding = next((h for h in candidates if h.symbol == symbol), None)
+        if not existing_holding and match_by_name:
+            existing_holding = next((h for h in candidates if h.stock_name == stock_name), None)
 
         if existing_holding:
             stock_name = stock_name or existing_holding.stock_name
@@ -372,7 +538,13 @@ def add_manual_transaction(session: Session, symbol: str, tx_type: str, quantity
         status="Executed"
     )
     
+    # Only this position changes, so patch its holding instead of replaying every transaction
+    incremental = _apply_to_holding(session, transaction)
     session.add(transaction)
-    session.commit()
-    update_holdings(session)
+    if incremental:
+        session.commit()
+        # The holding row no longer matches the last rebuild's signature
+        _mark_holdings_changed()
+    else:
+        update_holdings(session)
     return transaction
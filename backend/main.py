@@ -1,17 +1,26 @@
 from fastapi import FastAPI, UploadFile, File, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from typing import List
 import os
+import json
 import shutil
-from .database import get_session, create_db_and_tables
+import tempfile
+import logging
+from .database import get_session, create_db_and_tables, SessionLocal
 from .models import Transaction, Holding
 from .ingestion import ingest_excel, update_holdings, add_manual_transaction
-from .schemas import ManualTransactionInput
-from .agent import get_ai_response
-from sqlmodel import select
+from .schemas import ManualTransactionInput, ValuationPoint
+from .utils import get_real_time_prices, get_valuation_history, calculate_xirr
+from .cache import (
+    get_cached, set_cached, valuation_history_cache, xirr_projection_cache, stale_valuation_history
+)
+from sqlmodel import select, func, case, delete
 from pydantic import BaseModel
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
 app = FastAPI(title="Portfolio Risk Exposure Intelligence API")
 
 # Initialize DB on startup
@@ -20,25 +29,31 @@ def on_startup():
     create_db_and_tables()
 
 @app.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
+def upload_file(file: UploadFile = File(...)):
     if not file.filename.endswith(('.xlsx', '.xls')):
         raise HTTPException(status_code=400, detail="Invalid file format. Please upload an Excel file.")
     
-    temp_path = f"temp_{file.filename}"
-    with open(temp_path, "wb") as buffer:
+    # Uploads run concurrently in the threadpool, so each gets its own temp file
+    with tempfile.NamedTemporaryFile(suffix=os.path.splitext(file.filename)[1], delete=False) as buffer:
         shutil.copyfileobj(file.file, buffer)
+        temp_path = buffer.name
     
     try:
         ingest_excel(temp_path)
         return {"message": "File processed successfully"}
+    except (ValueError, KeyError) as e:
+        # Malformed or unrecognised workbook layout (pandas ParserError is a ValueError)
+        logger.warning("Rejected upload %s: %s", file.filename, e)
+        raise HTTPException(status_code=400, detail=f"Error processing file: {str(e)}")
     except Exception as e:
+        logger.exception("Unexpected error ingesting %s", file.filename)
         raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
     finally:
         if os.path.exists(temp_path):
             os.remove(temp_path)
 
 @app.post("/transactions/manual")
-async def manual_entry(data: ManualTransactionInput, session: Session = Depends(get_session)):
+def manual_entry(data: ManualTransactionInput, session: Session = Depends(get_session)):
     try:
         transaction = add_manual_transaction(
             session=session,
@@ -55,26 +70,68 @@ async def manual_entry(data: ManualTransactionInput, session: Session = Depends(
         )
         return {"message": "Transaction added successfully", "order_id": transaction.order_id}
     except Exception as e:
+        logger.exception("Failed to add manual transaction for %s", data.symbol)
         raise HTTPException(status_code=500, detail=f"Error adding transaction: {str(e)}")
 
-@app.get("/transactions", response_model=List[Transaction])
-def get_transactions(session: Session = Depends(get_session)):
-    return session.exec(select(Transaction)).all()
+# Rows fetched (and encoded) per step while streaming /transactions
+TRANSACTION_STREAM_BATCH = 1000
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
 
-import pandas as pd
-from .utils import get_real_time_prices, get_valuation_history, calculate_xirr, get_valuation_history
+def _stream_json_array(result):
+    """Encodes result rows as one JSON array a batch at a time, so the table never sits in memory at once."""
+    yield "["
+    separator = ""
+    for batch in result.mappings().partitions():
+        yield separator + ",".join(json.dumps(dict(row), default=_json_default) for row in batch)
+        separator = ","
+    yield "]"
 
-@app.get("/valuation-history")
+# Still a plain JSON array (response_model only documents it), but streamed from plain
+# column rows: no ORM objects, no response validation, memory bounded by one batch
+@app.get("/transactions", response_model=List[Transaction])
+def get_transactions():
+    def body():
+        # Own session: the request-scoped one may be closed before the body finishes streaming
+        with SessionLocal() as session:
+            result = session.execute(
+                select(*Transaction.__table__.columns).execution_options(yield_per=TRANSACTION_STREAM_BATCH)
+            )
+            yield from _stream_json_array(result)
+    return StreamingResponse(body(), media_type="application/json")
+
+# With a response model FastAPI serializes straight to JSON bytes via pydantic-core,
+# skipping jsonable_encoder + json.dumps for the ~daily-points payload
+@app.get("/valuation-history", response_model=List[ValuationPoint])
 def valuation_history(session: Session = Depends(get_session)):
-    transactions = session.exec(select(Transaction)).all()
-    if not transactions:
+    cached = get_cached(valuation_history_cache, "history")
+    if cached is not None:
+        return cached
+
+    # Only the columns the valuation needs, as plain dicts (no ORM objects to build and dump)
+    rows = session.exec(
+        select(Transaction.symbol, Transaction.type, Transaction.quantity, Transaction.price, Transaction.execution_time)
+    ).all()
+    if not rows:
         return []
     
-    # Convert transactions to dicts for the utility function
-    tx_dicts = [tx.model_dump() for tx in transactions]
+    tx_dicts = [dict(row._mapping) for row in rows]
     history = get_valuation_history(tx_dicts)
+    if not history:
+        # Price fetch failed; fall back to the last good series instead of an empty chart
+        return get_cached(stale_valuation_history, "history") or []
+
+    set_cached(valuation_history_cache, "history", history)
+    set_cached(stale_valuation_history, "history", history)
     return history
 
+def _fetchable_symbols(holdings: List[Holding]) -> List[str]:
+    # Mutual funds only have a live quote when mapped to a Yahoo ticker
+    return [h.symbol for h in holdings if h.category != "Mutual Fund" or "." in h.symbol]
+
 @app.get("/holdings", response_model=List[Holding])
 def get_holdings(session: Session = Depends(get_session)):
     holdings = session.exec(select(Holding)).all()
@@ -82,8 +139,7 @@ def get_holdings(session: Session = Depends(get_session)):
         return []
     
     # Filter for symbols that can be fetched (primarily stocks)
-    fetchable_symbols = [h.symbol for h in holdings if h.category != "Mutual Fund" or "." in h.symbol]
-    live_prices = get_real_time_prices(fetchable_symbols)
+    live_prices = get_real_time_prices(_fetchable_symbols(holdings))
     
     # Update holdings with live prices if available, otherwise keep existing
     updated_holdings = []
@@ -102,9 +158,6 @@ def get_holdings(session: Session = Depends(get_session)):
         updated_holdings.append(holding)
     
     session.commit()
-    for h in updated_holdings:
-        session.refresh(h)
-        
     return updated_holdings
 
 class ChatMessage(BaseModel):
@@ -115,50 +168,60 @@ class ChatRequest(BaseModel):
     history: List[ChatMessage]
 
 @app.post("/chat")
-async def chat(request: ChatRequest):
+def chat(request: ChatRequest):
     try:
+        # Imported lazily: only chat needs CrewAI, which takes seconds to import
+        from .agent import get_ai_response
+
         # Convert history to list of dicts for the agent
         history_dicts = [{"role": msg.role, "content": msg.content} for msg in request.history]
         response = get_ai_response(history_dicts)
         return {"response": response}
     except Exception as e:
+        logger.exception("Chat request failed")
         raise HTTPException(status_code=500, detail=f"Error in chat: {str(e)}")
 
 @app.delete("/transactions/{order_id}")
 def delete_transaction(order_id: str, session: Session = Depends(get_session)):
-    transaction = session.exec(select(Transaction).where(Transaction.order_id == order_id)).first()
-    if not transaction:
+    # Single DELETE statement; the affected row count doubles as the existence check
+    # order_id isn't unique (re-uploaded MF statements repeat it); remove a single row, picked by id
+    first_match = select(Transaction.id).where(Transaction.order_id == order_id).order_by(Transaction.id).limit(1)
+    result = session.execute(delete(Transaction).where(Transaction.id == first_match.scalar_subquery()))
+    if result.rowcount == 0:
         raise HTTPException(status_code=404, detail="Transaction not found")
     
-    session.delete(transaction)
-    session.commit()
+    # Commits the delete together with the resynced holdings
     update_holdings(session)
     return {"message": "Transaction deleted and holdings synced successfully"}
 
 @app.get("/xirr-projection")
 def xirr_projection(years: int = 5, session: Session = Depends(get_session)):
-    transactions = session.exec(select(Transaction)).all()
-    if not transactions:
+    cached = get_cached(xirr_projection_cache, years)
+    if cached is not None:
+        return cached
+
+    # BUY is negative cash flow (money going out)
+    # SELL is positive cash flow (money coming in)
+    # Net them per execution time in SQL instead of loading every Transaction row
+    signed_amount = case((func.upper(Transaction.type) == "BUY", -Transaction.price), else_=Transaction.price)
+    net_flows = session.exec(
+        select(Transaction.execution_time, func.sum(signed_amount)).group_by(Transaction.execution_time)
+    ).all()
+    if not net_flows:
         return {"xirr": 0, "projections": []}
     
     holdings = session.exec(select(Holding)).all()
     
     # Calculate current valuation
     total_valuation = 0
-    fetchable_symbols = [h.symbol for h in holdings if h.category != "Mutual Fund" or "." in h.symbol]
-    live_prices = get_real_time_prices(fetchable_symbols)
+    live_prices = get_real_time_prices(_fetchable_symbols(holdings))
     
     for holding in holdings:
         price = live_prices.get(holding.symbol) or holding.current_price or 0
         total_valuation += price * holding.quantity
         
     # Prepare cash flows for XIRR
-    cash_flows = []
-    for tx in transactions:
-        # BUY is negative cash flow (money going out)
-        # SELL is positive cash flow (money coming in)
-        amount = -tx.price if tx.type.upper() == "BUY" else tx.price
-        cash_flows.append({"date": tx.execution_time, "amount": amount})
+    cash_flows = [{"date": executed_at, "amount": amount} for executed_at, amount in net_flows]
     
     # Add current valuation as a positive cash flow as of today
     cash_flows.append({"date": datetime.now(), "amount": total_valuation})
@@ -186,10 +249,12 @@ def xirr_projection(years: int = 5, session: Session = Depends(get_session)):
             "value": round(projected_value, 2)
         })
         
-    return {
+    result = {
         "xirr": round(xirr * 100, 2), # Return as percentage
         "projections": projections
     }
+    set_cached(xirr_projection_cache, years, result)
+    return result
 
 @app.get("/health")
 def health_check():
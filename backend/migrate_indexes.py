@@ -0,0 +1,38 @@
+import sqlite3
+import os
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DB_PATH = os.path.join(BASE_DIR, "portfolio_v2.db")
+
+# create_all() only builds indexes for new tables, so existing databases need these added by hand
+INDEXES = [
+    ('ix_transaction_symbol_folio', 'CREATE INDEX IF NOT EXISTS ix_transaction_symbol_folio ON "transaction" (symbol, folio_number)'),
+    ('ix_transaction_symbol_time', 'CREATE INDEX IF NOT EXISTS ix_transaction_symbol_time ON "transaction" (symbol, execution_time)'),
+    ('ix_transaction_execution_time', 'CREATE INDEX IF NOT EXISTS ix_transaction_execution_time ON "transaction" (execution_time)'),
+    ('ix_holding_symbol_folio', 'CREATE INDEX IF NOT EXISTS ix_holding_symbol_folio ON holding (symbol, folio_number)'),
+]
+
+def migrate():
+    if not os.path.exists(DB_PATH):
+        print(f"Database {DB_PATH} not found.")
+        return
+
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+
+    try:
+        for name, ddl in INDEXES:
+            print(f"Creating index {name}...")
+            cursor.execute(ddl)
+
+        # Refresh planner statistics so SQLite actually picks the new indexes
+        cursor.execute("ANALYZE")
+        conn.commit()
+        print("Migration completed successfully!")
+    except Exception as e:
+        print(f"An error occurred: {e}")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    migrate()
@@ -1,8 +1,13 @@
 from datetime import datetime
 from typing import Optional
-from sqlmodel import Field, SQLModel
+from sqlmodel import Field, SQLModel, Index
 
 class Transaction(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_transaction_symbol_folio", "symbol", "folio_number"),
+        Index("ix_transaction_symbol_time", "symbol", "execution_time"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     stock_name: str
     symbol: str
@@ -12,13 +17,17 @@ class Transaction(SQLModel, table=True):
     price: float
     exchange: str
     order_id: str = Field(index=True)
-    execution_time: datetime
+    execution_time: datetime = Field(index=True)
     geography: str = Field(default="India")
     category: str = Field(default="Equity(Stocks)")
     folio_number: Optional[str] = Field(default=None)
     status: str
 
 class Holding(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_holding_symbol_folio", "symbol", "folio_number"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     symbol: str = Field(index=True)
     stock_name: str
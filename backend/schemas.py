@@ -14,3 +14,8 @@ class ManualTransactionInput(BaseModel):
     category: Optional[str] = "Equity(Stocks)"
     folio_number: Optional[str] = None
     execution_time: Optional[datetime] = None
+
+class ValuationPoint(BaseModel):
+    date: str
+    invested_value: float
+    market_value: float
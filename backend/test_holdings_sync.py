@@ -0,0 +1,71 @@
+import os
+import sys
+from datetime import datetime
+
+# Ensure the parent directory is in the path so we can import backend
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from sqlmodel import SQLModel, Session, create_engine, select, delete
+from backend import ingestion
+from backend.ingestion import add_manual_transaction, add_transactions_bulk, update_holdings
+from backend.models import Holding, Transaction
+
+def _scratch_session(tmp_path):
+    # Own database file, so these tests never touch portfolio_v2.db
+    engine = create_engine(f"sqlite:///{tmp_path / 'holdings.db'}")
+    SQLModel.metadata.create_all(engine)
+    # The rebuild signature is process-wide; don't let another database's rebuild match this one
+    ingestion._mark_holdings_changed()
+    return Session(engine)
+
+def _buy(symbol, quantity, value, order_id):
+    return Transaction(stock_name=symbol, symbol=symbol, isin="TEST", type="BUY", quantity=quantity, price=value,
+                       exchange="NSE", order_id=order_id, execution_time=datetime(2024, 1, 2, 10, 0),
+                       geography="India", category="Equity(Stocks)", status="Executed")
+
+def _holding(session, symbol):
+    session.expire_all()
+    return session.exec(select(Holding).where(Holding.symbol == symbol)).first()
+
+def test_manual_add_then_delete_resyncs(tmp_path):
+    with _scratch_session(tmp_path) as session:
+        add_transactions_bulk(session, [_buy("TCS", 10, 35000.0, "1")])
+        assert _holding(session, "TCS").quantity == 10
+
+        tx = add_manual_transaction(session, "TCS", "BUY", 5, 18000.0, "NSE")
+        assert _holding(session, "TCS").quantity == 15
+
+        # Back to exactly the transactions of the first rebuild; the resync must still rebuild
+        session.execute(delete(Transaction).where(Transaction.order_id == tx.order_id))
+        update_holdings(session)
+        holding = _holding(session, "TCS")
+        assert holding.quantity == 10
+        assert holding.total_invested == 35000.0
+
+def test_manual_trades_match_full_rebuild(tmp_path):
+    with _scratch_session(tmp_path) as session:
+        add_transactions_bulk(session, [_buy("INFY", 10, 15000.0, "1")])
+        add_manual_transaction(session, "INFY", "BUY", 4, 6400.0, "NSE")
+        add_manual_transaction(session, "INFY", "SELL", 6, 9900.0, "NSE")
+        add_manual_transaction(session, "WIPRO", "BUY", 3, 1500.0, "NSE")
+        incremental = {(h.symbol, h.quantity, h.total_invested, h.avg_price)
+                       for h in session.exec(select(Holding)).all()}
+
+        ingestion._mark_holdings_changed()
+        update_holdings(session)
+        session.expire_all()
+        rebuilt = {(h.symbol, h.quantity, h.total_invested, h.avg_price)
+                   for h in session.exec(select(Holding)).all()}
+        assert incremental == rebuilt
+
+def test_resync_keeps_stored_price(tmp_path):
+    with _scratch_session(tmp_path) as session:
+        add_transactions_bulk(session, [_buy("ITC", 10, 4000.0, "1")])
+        holding = _holding(session, "ITC")
+        holding.current_price = 450.0
+        session.commit()
+
+        add_transactions_bulk(session, [_buy("ITC", 5, 2200.0, "2")])
+        holding = _holding(session, "ITC")
+        assert holding.quantity == 15
+        assert holding.current_price == 450.0
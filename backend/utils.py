@@ -1,42 +1,77 @@
 import yfinance as yf
 import pandas as pd
+import numpy as np
 from datetime import datetime
 from typing import List, Dict, Optional
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from .cache import get_cached, set_cached, live_price_cache, price_history_cache
 
 logger = logging.getLogger(__name__)
 
+def to_yahoo_symbol(symbol: str) -> str:
+    """Maps a portfolio symbol to its Yahoo Finance ticker: NSE unless an exchange suffix is already present."""
+    return symbol if "." in symbol else f"{symbol}.NS"
+
 def get_real_time_prices(symbols: List[str]) -> Dict[str, Optional[float]]:
     """
     Fetches real-time prices for a list of symbols using yfinance.
     Returns a dictionary mapping symbols to prices.
+    Prices fetched within the last minute are served from cache.
+    """
+    return _get_cached_prices(symbols, _download_real_time_prices, key_prefix="portfolio")
+
+def get_quote_prices(tickers: List[str]) -> Dict[str, Optional[float]]:
     """
+    Like get_real_time_prices, but for Yahoo tickers taken verbatim (no .NS suffixing),
+    e.g. AAPL or RELIANCE.NS. All tickers are fetched in one batched download.
+    """
+    return _get_cached_prices(tickers, download_yahoo_prices, key_prefix="yahoo")
+
+def _get_cached_prices(symbols, fetch, key_prefix):
+    prices_dict = {}
+    to_fetch = []
+    for s in symbols:
+        cached = get_cached(live_price_cache, (key_prefix, s))
+        if cached is not None:
+            prices_dict[s] = cached
+        else:
+            to_fetch.append(s)
+    
+    if to_fetch:
+        fetched = fetch(to_fetch)
+        for s, price in fetched.items():
+            if price is not None:
+                set_cached(live_price_cache, (key_prefix, s), price)
+        prices_dict.update(fetched)
+    return prices_dict
+
+def _download_real_time_prices(symbols: List[str]) -> Dict[str, Optional[float]]:
     if not symbols:
         return {}
     
     # Pre-process symbols to append .NS if suffix is missing
-    processed_symbols = []
-    symbol_map = {} 
-    
-    for s in symbols:
-        if "." not in s:
-            mapped = f"{s}.NS"
-        else:
-            mapped = s
-        processed_symbols.append(mapped)
-        symbol_map[mapped] = s
+    processed_symbols = [to_yahoo_symbol(s) for s in symbols]
+    fetched = download_yahoo_prices(list(dict.fromkeys(processed_symbols)))
+    return {original: fetched.get(mapped) for mapped, original in zip(processed_symbols, symbols)}
+
+def download_yahoo_prices(tickers: List[str]) -> Dict[str, Optional[float]]:
+    """Latest close for each Yahoo ticker from a single batched download, with fast_info as fallback."""
+    if not tickers:
+        return {}
 
-    symbols_str = " ".join(processed_symbols)
+    symbols_str = " ".join(tickers)
     try:
         # Remove interval="1m" to support Mutual Funds
         data = yf.download(symbols_str, period="1d", progress=False)
         prices_dict = {}
+        missing = []
         
-        for mapped, original in symbol_map.items():
+        for mapped in tickers:
             price = None
             try:
                 # Extract from batch data
-                if len(processed_symbols) == 1:
+                if len(tickers) == 1:
                     if not data.empty and 'Close' in data:
                         v = data['Close'].iloc[-1]
                         price = float(v) if not pd.isna(v) else None
@@ -44,33 +79,33 @@ def get_real_time_prices(symbols: List[str]) -> Dict[str, Optional[float]]:
                     if 'Close' in data and mapped in data['Close']:
                         v = data['Close'][mapped].iloc[-1]
                         price = float(v) if not pd.isna(v) else None
-                
-                # FALLBACK: If batch fails (common for MFs), use fast_info
-                if price is None:
-                    ticker = yf.Ticker(mapped)
-                    f_price = ticker.fast_info.last_price
-                    if f_price is not None and not pd.isna(f_price):
-                        price = float(f_price)
             except Exception as e:
                 logger.error(f"Error for {mapped}: {e}")
-                # Individual fallback attempt
-                try:
-                    price = float(yf.Ticker(mapped).fast_info.last_price)
-                except:
-                    price = None
             
-            prices_dict[original] = price
+            if price is None:
+                missing.append(mapped)
+            prices_dict[mapped] = price
         
+        # FALLBACK: If batch fails (common for MFs), use fast_info
+        prices_dict.update(_fetch_fast_info_prices(missing))
         return prices_dict
     except Exception as e:
         logger.error(f"Batch download failed: {e}. Falling back to individual fetches.")
-        prices_dict = {}
-        for mapped, original in symbol_map.items():
-            try:
-                prices_dict[original] = float(yf.Ticker(mapped).fast_info.last_price)
-            except:
-                prices_dict[original] = None
-        return prices_dict
+        return _fetch_fast_info_prices(tickers)
+
+def _fetch_fast_info_price(symbol: str) -> Optional[float]:
+    try:
+        price = yf.Ticker(symbol).fast_info.last_price
+        return float(price) if price is not None and not pd.isna(price) else None
+    except Exception:
+        return None
+
+def _fetch_fast_info_prices(symbols: List[str]) -> Dict[str, Optional[float]]:
+    """Fetches fast_info prices for several symbols concurrently (one HTTP round trip each)."""
+    if not symbols:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(8, len(symbols))) as executor:
+        return dict(zip(symbols, executor.map(_fetch_fast_info_price, symbols)))
 
 def get_market_data_live(symbol: str):
     """Returns market data for a single symbol with real-time fetching."""
@@ -97,6 +132,22 @@ def get_market_data_mock(symbol: str):
         "status": "stale"
     }
 
+def get_close_history(symbols: List[str], start_date: str, end_date: str) -> pd.DataFrame:
+    """
+    Returns daily close prices for Yahoo symbols between start_date and end_date.
+    Results are shared across callers and cached for an hour; empty downloads are not cached.
+    """
+    key = (tuple(sorted(symbols)), start_date, end_date)
+    cached = get_cached(price_history_cache, key)
+    if cached is not None:
+        return cached
+    
+    data = yf.download(" ".join(symbols), start=start_date, end=end_date, interval="1d", progress=False)
+    closes = data['Close']
+    if not closes.empty:
+        set_cached(price_history_cache, key, closes)
+    return closes
+
 def get_valuation_history(transactions: List[Dict]) -> List[Dict]:
     """
     Calculates daily portfolio valuation history.
@@ -108,8 +159,8 @@ def get_valuation_history(transactions: List[Dict]) -> List[Dict]:
     df_tx['execution_time'] = pd.to_datetime(df_tx['execution_time'])
     
     symbols = df_tx['symbol'].unique().tolist()
-    processed_symbols = [f"{s}.NS" if "." not in s else s for s in symbols]
-    symbol_map = {f"{s}.NS" if "." not in s else s: s for s in symbols}
+    processed_symbols = [to_yahoo_symbol(s) for s in symbols]
+    symbol_map = dict(zip(processed_symbols, symbols))
     
     start_date = df_tx['execution_time'].min().strftime('%Y-%m-%d')
     # Use tomorrow as end_date to ensure we get today's data if available
@@ -117,8 +168,7 @@ def get_valuation_history(transactions: List[Dict]) -> List[Dict]:
     
     try:
         # Fetch daily close prices
-        data = yf.download(" ".join(processed_symbols), start=start_date, end=end_date, interval="1d", progress=False)
-        hist_data = data['Close']
+        hist_data = get_close_history(processed_symbols, start_date, end_date)
         
         if len(processed_symbols) == 1:
             hist_data = hist_data.to_frame()
@@ -131,76 +181,76 @@ def get_valuation_history(transactions: List[Dict]) -> List[Dict]:
         # Get live prices for today's fallback
         live_prices = get_real_time_prices(symbols)
         
-        today_date = datetime.now().date()
-        timeline = pd.date_range(start=start_date, end=datetime.now(), freq='D')
-        valuation_history = []
-        
-        # Keep track of last known prices per symbol to carry forward manually if needed
-        last_known_prices = {s: 0.0 for s in symbols}
-        
-        for current_ts in timeline:
-            current_date = current_ts.date()
-            mask = df_tx['execution_time'] <= pd.Timestamp(current_date) + pd.Timedelta(days=1) - pd.Timedelta(seconds=1)
-            past_tx = df_tx[mask]
-            
-            total_invested = 0
-            total_valuation = 0
-            
-            for symbol in symbols:
-                sym_tx = past_tx[past_tx['symbol'] == symbol]
-                if sym_tx.empty:
-                    continue
-                
-                qty = 0
-                sym_invested = 0
-                for _, tx in sym_tx.iterrows():
-                    if tx['type'].upper() == 'BUY':
-                        qty += tx['quantity']
-                        sym_invested += tx['price']
-                    else:
-                        if qty > 0:
-                            reduction_ratio = tx['quantity'] / qty
-                            sym_invested *= (1 - reduction_ratio)
-                        qty -= tx['quantity']
-                
-                total_invested += sym_invested
-                
-                if qty > 0:
-                    price = 0
-                    # Try getting price from history
-                    if symbol in hist_data.columns:
-                        # Find closest date in index that is <= current_date
-                        valid_idx = hist_data.index[hist_data.index.date <= current_date]
-                        if not valid_idx.empty:
-                            hist_price = hist_data.loc[valid_idx[-1], symbol]
-                            if not pd.isna(hist_price):
-                                price = hist_price
-                                last_known_prices[symbol] = price
-                    
-                    # For today, if hist is missing or we want latest, use live_prices
-                    if current_date == today_date:
-                        lp = live_prices.get(symbol)
-                        if lp is not None:
-                            price = lp
-                            last_known_prices[symbol] = price
-                    
-                    # Final fallback: use last known
-                    if price == 0 or pd.isna(price):
-                        price = last_known_prices.get(symbol, 0.0)
-                        
-                    total_valuation += (qty * price)
-            
-            valuation_history.append({
-                "date": current_date.isoformat(),
-                "invested_value": round(float(total_invested), 2),
-                "market_value": round(float(total_valuation), 2)
-            })
-            
-        return valuation_history
+        return compute_valuation_history(df_tx, hist_data, live_prices, start_date)
     except Exception as e:
         logger.error(f"Error calculating valuation history: {e}")
         return []
 
+def compute_valuation_history(df_tx: pd.DataFrame, hist_data: pd.DataFrame, live_prices: Dict[str, Optional[float]], start_date: str) -> List[Dict]:
+    """
+    Pure computation half of get_valuation_history: no network access.
+    df_tx: transactions with parsed execution_time; hist_data: daily closes keyed by portfolio symbol.
+    """
+    symbols = df_tx['symbol'].unique().tolist()
+    today_date = datetime.now().date()
+    timeline = pd.date_range(start=start_date, end=datetime.now(), freq='D')
+    
+    # Running quantity / invested amount per symbol after each transaction, in one pass
+    df_tx = df_tx.sort_values('execution_time', kind='stable')
+    qty_state, invested_state = {}, {}
+    qty_after, invested_after = [], []
+    for symbol, tx_type, quantity, amount in zip(df_tx['symbol'], df_tx['type'].str.upper(), df_tx['quantity'], df_tx['price']):
+        qty = qty_state.get(symbol, 0)
+        sym_invested = invested_state.get(symbol, 0)
+        if tx_type == 'BUY':
+            qty += quantity
+            sym_invested += amount
+        else:
+            if qty > 0:
+                reduction_ratio = quantity / qty
+                sym_invested *= (1 - reduction_ratio)
+            qty -= quantity
+        qty_state[symbol] = qty
+        invested_state[symbol] = sym_invested
+        qty_after.append(qty)
+        invested_after.append(sym_invested)
+    df_tx['qty_after'] = qty_after
+    df_tx['invested_after'] = invested_after
+    
+    # End-of-day position per symbol, carried forward across the daily timeline
+    df_tx['day'] = df_tx['execution_time'].dt.normalize()
+    end_of_day = df_tx.groupby(['day', 'symbol'])[['qty_after', 'invested_after']].last()
+    daily_qty = end_of_day['qty_after'].unstack().reindex(index=timeline, columns=symbols).ffill()
+    daily_invested = end_of_day['invested_after'].unstack().reindex(index=timeline, columns=symbols).ffill().fillna(0)
+    
+    # Latest close on or before each day; today's live price wins where available
+    hist_daily = hist_data.copy()
+    hist_daily.index = pd.DatetimeIndex(hist_daily.index).tz_localize(None).normalize()
+    hist_daily = hist_daily[~hist_daily.index.duplicated(keep='last')].sort_index()
+    daily_prices = hist_daily.reindex(columns=symbols).reindex(timeline, method='ffill')
+    today_ts = pd.Timestamp(today_date)
+    if today_ts in daily_prices.index:
+        live = pd.Series(live_prices, dtype=float).reindex(symbols)
+        daily_prices.loc[today_ts] = live.combine_first(daily_prices.loc[today_ts])
+    daily_prices = daily_prices.fillna(0)
+    
+    # Both frames share the (timeline x symbols) layout, so combine the raw matrices
+    qty_matrix = daily_qty.to_numpy(dtype=float)
+    held = np.where(qty_matrix > 0, qty_matrix, 0.0)
+    invested_values = daily_invested.to_numpy(dtype=float).sum(axis=1)
+    market_values = np.einsum('ij,ij->i', held, daily_prices.to_numpy(dtype=float))
+    
+    valuation_history = [
+        {
+            "date": ts.date().isoformat(),
+            "invested_value": round(float(invested), 2),
+            "market_value": round(float(market), 2)
+        }
+        for ts, invested, market in zip(timeline, invested_values, market_values)
+    ]
+        
+    return valuation_history
+
 def calculate_xirr(cash_flows: List[Dict[str, any]]) -> Optional[float]:
     """
     Calculates the Internal Rate of Return for a series of cash flows at irregular intervals.
@@ -37,6 +37,11 @@ def format_indian_currency(amount: float) -> str:
 # Constants
 BACKEND_URL = "http://localhost:8000"
 
+@st.cache_resource
+def get_http_session() -> requests.Session:
+    """One keep-alive session for all backend calls, reused across Streamlit reruns."""
+    return requests.Session()
+
 st.set_page_config(
     page_title="Portfolio Risk Exposure Intelligence",
     page_icon="📊",
@@ -44,6 +49,8 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
+http = get_http_session()
+
 # Custom CSS for Premium Look
 st.markdown("""
 <style>
@@ -201,7 +208,7 @@ with tabs[0]: # Dashboard
     st.header("Portfolio Overview")
     
     try:
-        response = requests.get(f"{BACKEND_URL}/holdings")
+        response = http.get(f"{BACKEND_URL}/holdings")
         if response.status_code == 200:
             holdings = response.json()
             if holdings:
@@ -312,17 +319,14 @@ with tabs[0]: # Dashboard
                     df_holdings['pnl_%'] = (df_holdings['pnl'] / df_holdings['total_invested'] * 100).fillna(0)
                 
                 # Add stale indicator to current_price and current_valuation
-                def format_price(row):
-                    if pd.isna(row['last_updated_at']):
-                        return f"{format_indian_currency(row['current_price'])} (stale)"
-                    
-                    diff = datetime.now() - pd.to_datetime(row['last_updated_at'])
-                    if diff.total_seconds() > 3600: # 1 hour
-                        return f"{format_indian_currency(row['current_price'])} (stale)"
-                    return format_indian_currency(row['current_price'])
- 
                 if 'current_price' in df_holdings and not df_holdings.empty:
-                    df_holdings['display_price'] = df_holdings.apply(format_price, axis=1)
+                    # Staleness is computed for the whole column; only the string formatting stays per row
+                    updated_at = pd.to_datetime(df_holdings['last_updated_at'], format='ISO8601')
+                    is_stale = updated_at.isna() | ((datetime.now() - updated_at).dt.total_seconds() > 3600) # 1 hour
+                    df_holdings['display_price'] = [
+                        f"{format_indian_currency(price)} (stale)" if stale else format_indian_currency(price)
+                        for price, stale in zip(df_holdings['current_price'], is_stale)
+                    ]
                 
                 cols_to_show = ['stock_name', 'symbol', 'category', 'quantity', 'avg_price', 'total_invested']
                 if 'current_price' in df_holdings:
@@ -366,7 +370,7 @@ with tabs[0]: # Dashboard
                 st.divider()
                 st.subheader("Capital Deployment & Valuation History")
                 try:
-                    res_hist = requests.get(f"{BACKEND_URL}/valuation-history")
+                    res_hist = http.get(f"{BACKEND_URL}/valuation-history")
                     if res_hist.status_code == 200:
                         hist_data = res_hist.json()
                         if hist_data:
@@ -431,7 +435,7 @@ with tabs[1]: # Transactions
     st.header("Transaction Ledger")
     
     try:
-        response = requests.get(f"{BACKEND_URL}/transactions")
+        response = http.get(f"{BACKEND_URL}/transactions")
         if response.status_code == 200:
             transactions = response.json()
             if transactions:
@@ -460,7 +464,7 @@ with tabs[2]: # XIRR & Projections
         st.info("XIRR (Extended Internal Rate of Return) represents the actual annual growth rate of your investments, accounting for the timing of all cash flows (buys and sells).")
         
     try:
-        response = requests.get(f"{BACKEND_URL}/xirr-projection", params={"years": projection_years})
+        response = http.get(f"{BACKEND_URL}/xirr-projection", params={"years": projection_years})
         if response.status_code == 200:
             data = response.json()
             xirr = data.get("xirr", 0)
@@ -576,7 +580,7 @@ with tabs[3]: # Manual Entry
                 }
                 
                 try:
-                    response = requests.post(f"{BACKEND_URL}/transactions/manual", json=payload)
+                    response = http.post(f"{BACKEND_URL}/transactions/manual", json=payload)
                     if response.status_code == 200:
                         st.success(f"✅ Transaction Securely Recorded! Order ID: `{response.json().get('order_id')}`")
                     else:
@@ -593,7 +597,7 @@ with tabs[4]: # Upload Data
         if st.button("Process & Sync File"):
             with st.spinner("Analyzing and synchronizing data..."):
                 try:
-                    response = requests.post(f"{BACKEND_URL}/upload", files={"file": (uploaded_file.name, uploaded_file.getvalue(), "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")})
+                    response = http.post(f"{BACKEND_URL}/upload", files={"file": (uploaded_file.name, uploaded_file.getvalue(), "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")})
                     if response.status_code == 200:
                         st.success("✨ Portfolio successfully synchronized!")
                         st.balloons()
@@ -658,7 +662,7 @@ with tabs[5]: # AI Assistant
  
         try:
             with st.spinner("AI is thinking..."):
-                response = requests.post(
+                response = http.post(
                     f"{BACKEND_URL}/chat", 
                     json={"history": st.session_state.messages}
                 )
@@ -1,10 +1,10 @@
 import sys
 import os
 
-# Add backend to path
-sys.path.append(os.path.join(os.getcwd(), 'backend'))
+# Add the project root to sys.path to import backend modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from utils import get_real_time_prices
+from backend.utils import get_real_time_prices
 
 def verify_fix():
     ticker = "0P0000YWL1.BO"